@@ -9,16 +9,73 @@ Imported by install / operate / cleanup, and usable directly as:
 
 which prints the Ansible expects.
 """
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from openstack import connection
+from keystoneauth1.session import TCPKeepAliveAdapter
+import functools
+import ipaddress
 import json
 import logging
+import math
 import os
+import random
+import re
+import socket
 import subprocess
 import sys
+import threading
 import time
 
+try:
+    import orjson
+except ImportError:  # optional, stdlib json is used without it
+    orjson = None
+
 LOG = logging.getLogger(__name__)
 
+# `export KEY=value` lines of an openrc file; the value may be quoted
+_RC_RE = re.compile(r"^\s*export\s+(\w+)=(.*)$", re.M)
+
+# image / flavor listings are reused for this many seconds per Connection
+LISTING_TTL = 60
+
+
+def _env_seconds(name, default, minimum=1.0):
+    """Read a number of seconds (at least *minimum*) from env var *name*."""
+    raw = os.environ.get(name)
+    if not raw:
+        return default
+    try:
+        value = float(raw)
+    except ValueError:
+        value = math.nan
+    if not math.isfinite(value):
+        LOG.warning("Ignoring %s=%r: not a finite number", name, raw)
+        return default
+    return max(minimum, value)
+
+
+# polling back-off: start at 1s, double each round, never above
+# OS_POLL_INTERVAL seconds; waits give up after OS_WAIT_TIMEOUT seconds
+BACKOFF_START = 1.0
+BACKOFF_MAX = _env_seconds("OS_POLL_INTERVAL", 15.0)
+WAIT_TIMEOUT = _env_seconds("OS_WAIT_TIMEOUT", 900.0)
+
+
+def _backoff(delay, deadline, stop=None):
+    """
+    Sleep *delay* seconds plus up to 25% jitter, but never past *deadline*
+    (a time.monotonic() value) and waking early if *stop* is set; return the
+    next delay.
+    """
+    pause = delay + random.uniform(0, 0.25 * delay)
+    pause = max(0, min(pause, deadline - time.monotonic()))
+    if stop is not None:
+        stop.wait(pause)
+    else:
+        time.sleep(pause)
+    return min(delay * 2, BACKOFF_MAX)
+
 #helper
 def build_cfg(path, priv, bast_ip, pairs, proxy_ip=None, tag=""):
     with open(path, "w") as f:
@@ -45,16 +102,27 @@ def build_cfg(path, priv, bast_ip, pairs, proxy_ip=None, tag=""):
                 )
                 
                 
+def _unquote(value):
+    """Strip whitespace and one pair of matching surrounding quotes."""
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+        return value[1:-1]
+    return value
+
+
 def conn_from_rc(rc_path):
     """Return an OpenStackSDK Connection using variables in an openrc file."""
-    env = {}
+    rc_path = os.path.abspath(rc_path)
+    return _conn_cached(rc_path, os.stat(rc_path).st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=4)
+def _conn_cached(rc_path, mtime):
+    """Build the Connection once per (rc file, mtime) so the token is reused."""
     with open(rc_path) as fh:
-        for line in fh:
-            if line.startswith("export"):
-                k, v = line.split(None, 1)[1].split("=", 1)
-                env[k] = v.strip().strip('"').strip("'")
+        env = {k: _unquote(v) for k, v in _RC_RE.findall(fh.read())}
 
-    return connection.Connection(
+    conn = connection.Connection(
         auth_url=env["OS_AUTH_URL"],
         project_name=env["OS_PROJECT_NAME"],
         username=env["OS_USERNAME"],
@@ -63,93 +131,191 @@ def conn_from_rc(rc_path):
         project_domain_name=env.get("OS_PROJECT_DOMAIN_NAME", "Default"),
         region_name=env.get("OS_REGION_NAME"),
     )
+    # bigger pool, same TCP keep-alive adapter keystoneauth mounts by default
+    adapter = TCPKeepAliveAdapter(pool_connections=16, pool_maxsize=32)
+    for scheme in ("https://", "http://"):
+        conn.session.session.mount(scheme, adapter)
+    return conn
+
+
+def _cached_listing(conn, kind, fetch):
+    """
+    Return list(fetch()), reusing the result for LISTING_TTL seconds.  The
+    cache lives on *conn* itself so it goes away with the Connection.
+    """
+    attr = f"_{kind}_cache"
+    hit = getattr(conn, attr, None)
+    if hit and time.monotonic() - hit[0] < LISTING_TTL:
+        return hit[1]
+    items = list(fetch())
+    setattr(conn, attr, (time.monotonic(), items))
+    return items
 
 
 def pick_image(conn, pattern="Ubuntu 20.04"):
-    imgs = [i for i in conn.compute.images() if pattern in i.name]
-    if not imgs:
+    img = max((i for i in _cached_listing(conn, "images", conn.compute.images)
+               if pattern in i.name),
+              key=lambda i: i.updated_at, default=None)
+    if img is None:
         raise RuntimeError(f'No image with "{pattern}" in name')
-    return sorted(imgs, key=lambda i: i.updated_at)[-1]
+    return img
 
 
-def wait_active(conn, server, timeout=900):
-    """Block until *server* status becomes ACTIVE, or raise TimeoutError."""
-    for _ in range(timeout // 5):
-        srv = conn.compute.get_server(server.id)
+def _raise_if_error(srv):
+    if srv.status == "ERROR":
+        raise RuntimeError(f"{srv.name} went to ERROR: {srv.fault}")
+
+
+def wait_active(conn, server, timeout=WAIT_TIMEOUT, stop=None):
+    """
+    Block until *server* status becomes ACTIVE; raise RuntimeError if it goes
+    to ERROR, or TimeoutError.  Returns None early if the threading.Event
+    *stop* is set.
+    """
+    get, sid = conn.compute.get_server, server.id
+    deadline = time.monotonic() + timeout
+    delay = BACKOFF_START
+    while time.monotonic() < deadline:
+        if stop is not None and stop.is_set():
+            return None
+        srv = get(sid)
         if srv.status == "ACTIVE":
             return srv
-        time.sleep(5)
-    raise TimeoutError(f"{server.name} not ACTIVE within {timeout}s")
+        _raise_if_error(srv)
+        delay = _backoff(delay, deadline, stop)
+    raise TimeoutError(f"{server.name} not ACTIVE within {timeout:g}s")
 
 
 def choose_flavor(conn, min_vcpu=1, min_ram=0):
-    cands = [f for f in conn.compute.flavors()
-             if f.vcpus >= min_vcpu and f.ram >= min_ram]
-    if not cands:
+    flv = min((f for f in _cached_listing(conn, "flavors", conn.compute.flavors)
+               if f.vcpus >= min_vcpu and f.ram >= min_ram),
+              key=lambda f: (f.vcpus, f.ram), default=None)
+    if flv is None:
         raise RuntimeError("No flavor meets vCPU/RAM requirements")
-    return sorted(cands, key=lambda f: (f.vcpus, f.ram))[0]
+    return flv
+
+
+def _ssh_banner(host, port=22, timeout=5):
+    """Return True if *host* answers on *port* with an SSH banner."""
+    try:
+        with socket.create_connection((host, port), timeout) as sock:
+            sock.settimeout(timeout)
+            banner = b""
+            while len(banner) < 4:
+                chunk = sock.recv(4 - len(banner))
+                if not chunk:
+                    break
+                banner += chunk
+            return banner == b"SSH-"
+    except OSError:
+        return False
+
+
+def _is_ip(host):
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
 
 
-def wait_ssh(host, user="ubuntu", key_path=None, timeout=900, ssh_config=None):
+def wait_ssh(host, user="ubuntu", key_path=None, timeout=WAIT_TIMEOUT,
+             ssh_config=None):
     """
     Return True when SSH to *user@host* succeeds, False after *timeout* seconds.
+
+    When *host* is a literal IP and no *ssh_config* is given, port 22 is first
+    probed for the sshd banner over a plain socket and the real ssh login is
+    only attempted once sshd is answering.  Names are left to ssh, since
+    ~/.ssh/config may map them to another port or a proxy; an IP that
+    ~/.ssh/config reroutes the same way will never pass the probe.
     """
     key_path = key_path or os.path.expanduser("~/.ssh/id_rsa")
-    start = time.time()
-    while time.time() - start < timeout:
-        cmd = [
-            "ssh", "-o", "BatchMode=yes", "-o", "StrictHostKeyChecking=no",
-            "-o", "ConnectTimeout=5"
-        ]
-        if ssh_config:
-            cmd += ["-F", ssh_config]
-        if key_path and os.path.exists(key_path): 
-            cmd += ["-i", key_path]
-        cmd += [f"{user}@{host}", "true"]
-
-        if subprocess.run(cmd,
-                          stdout=subprocess.DEVNULL,
-                          stderr=subprocess.DEVNULL).returncode == 0:
-            return True
-        time.sleep(5)
-    LOG.warning("SSH to %s@%s not ready after %ds", user, host, timeout)
+    cmd = [
+        "ssh", "-o", "BatchMode=yes", "-o", "StrictHostKeyChecking=no",
+        "-o", "ConnectTimeout=5"
+    ]
+    if ssh_config:
+        cmd += ["-F", ssh_config]
+    if key_path and os.path.exists(key_path):
+        cmd += ["-i", key_path]
+    cmd += [f"{user}@{host}", "true"]
+
+    probe = not ssh_config and _is_ip(host)
+    deadline = time.monotonic() + timeout
+    delay = BACKOFF_START
+    while time.monotonic() < deadline:
+        # bound each attempt by the time left so the total stays in budget
+        left = max(1, deadline - time.monotonic())
+        if not probe or _ssh_banner(host, timeout=min(5, left)):
+            try:
+                if subprocess.run(cmd,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL,
+                                  timeout=left).returncode == 0:
+                    return True
+            except subprocess.TimeoutExpired:
+                pass
+        delay = _backoff(delay, deadline)
+    LOG.warning("SSH to %s@%s not ready after %gs", user, host, timeout)
     return False
 
+
+def wait_active_many(conn, servers, timeout=WAIT_TIMEOUT):
+    """wait_active for several servers at once; returns them in input order."""
+    if not servers:
+        return []
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=min(32, len(servers))) as pool:
+        futs = {pool.submit(wait_active, conn, s, timeout, stop): i
+                for i, s in enumerate(servers)}
+        done = [None] * len(servers)
+        try:
+            for fut in as_completed(futs):
+                done[futs[fut]] = fut.result()
+        except BaseException:
+            # first failure wins: wake the other waiters so shutdown is quick
+            stop.set()
+            raise
+    return done
+
+
+def wait_ssh_many(hosts, user="ubuntu", key_path=None, timeout=WAIT_TIMEOUT,
+                  ssh_config=None):
+    """wait_ssh for several hosts at once; returns {host: ready}."""
+    if not hosts:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(32, len(hosts))) as pool:
+        futs = {pool.submit(wait_ssh, h, user, key_path, timeout, ssh_config): h
+                for h in hosts}
+        return {futs[fut]: fut.result() for fut in as_completed(futs)}
+
 #implementation
 def _collect_inventory(conn, tag, key_path):
     """Return dict suitable for Ansible JSON inventory."""
     proxy_hosts, bastion_hosts, node_hosts = [], [], []
+    group = {"proxy": proxy_hosts, "bastion": bastion_hosts}
     hostvars = {}
+    base = {"ansible_user": "ubuntu", "ansible_ssh_private_key_file": key_path}
 
-    for srv in conn.compute.servers():
+    prefix = f"{tag}_"
+    # Nova treats `name` as a regex, so let the API do the tag filtering
+    for srv in conn.compute.servers(details=True,
+                                    name=f"^{re.escape(prefix)}"):
         name = srv.name
-        if not name.startswith(f"{tag}_"):
+        if not name.startswith(prefix):
             continue
 
         # Pick floating IP first, else first fixed IP
-        chosen_ip = None
-        for net in srv.addresses.values():
-            for a in net:
-                if a.get("OS-EXT-IPS:type") == "floating":
-                    chosen_ip = a["addr"]
-                    break
-            if chosen_ip:
-                break
-        if not chosen_ip:
-            chosen_ip = next(iter(srv.addresses.values()))[0]["addr"]
-
-        hostvars[name] = {
-            "ansible_host": chosen_ip,
-            "ansible_user": "ubuntu",
-            "ansible_ssh_private_key_file": key_path,
-        }
-
-        if name.endswith("_proxy"):
-            proxy_hosts.append(name)
-        elif name.endswith("_bastion"):
-            bastion_hosts.append(name)
-        else:
-            node_hosts.append(name)
+        chosen_ip = next(
+            (a["addr"] for net in srv.addresses.values() for a in net
+             if a.get("OS-EXT-IPS:type") == "floating"),
+            None,
+        ) or next(iter(srv.addresses.values()))[0]["addr"]
+
+        hostvars[name] = dict(base, ansible_host=chosen_ip)
+
+        group.get(name.rpartition("_")[2], node_hosts).append(name)
 
     return {
         "_meta": {"hostvars": hostvars},
@@ -169,7 +335,12 @@ def inventory_main():
     key_path = os.path.expanduser(os.environ.get("SSH_KEY", "~/.ssh/id_rsa"))
     conn = conn_from_rc(rc_path)
     inventory = _collect_inventory(conn, tag, key_path)
-    print(json.dumps(inventory, indent=2))
+    # compact output: Ansible parses it, nobody reads it
+    if orjson is not None:
+        sys.stdout.buffer.write(orjson.dumps(inventory) + b"\n")
+    else:
+        json.dump(inventory, sys.stdout, separators=(",", ":"))
+        sys.stdout.write("\n")
 
 
 if __name__ == "__main__":